@@ -0,0 +1,334 @@
+"""Git helpers shared by commits.py and patchsets.py."""
+import json
+import shlex
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+
+def decode(raw):
+    """Decode raw git output, keeping any non-UTF-8 bytes as surrogate escapes."""
+    return raw.decode("utf-8", "surrogateescape")
+
+
+def run_command(*argv, fatal=True):
+    """Run a command and return its raw output.
+
+    If the command fails and fatal is False, a warning is printed and None
+    is returned instead of exiting.
+    """
+    try:
+        result = subprocess.run(
+            argv,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        return result.stdout.strip()
+    except subprocess.CalledProcessError as e:
+        kind = "Error" if fatal else "Warning"
+        print(f"{kind} executing command: {shlex.join(argv)}", file=sys.stderr)
+        print(f"{kind} details: {decode(e.stderr)}", file=sys.stderr)
+        if fatal:
+            sys.exit(1)
+        return None
+
+
+def run_command_stream(*argv, separator=b"\n"):
+    """Run a command and yield its raw output one record at a time.
+
+    Records (by default lines) are yielded as soon as they are read, so the
+    caller's parsing overlaps with the command running rather than waiting
+    for all of its output to be buffered.
+    """
+    # stderr goes to a temporary file rather than a pipe: it is only read
+    # once stdout is exhausted, and a full stderr pipe would block the
+    # command before then. If the caller stops early, leaving the with block
+    # closes stdout (so the command dies of SIGPIPE) and reaps it.
+    with tempfile.TemporaryFile() as stderr, subprocess.Popen(
+        argv,
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+    ) as proc:
+        pending = b""
+        for chunk in iter(lambda: proc.stdout.read(65536), b""):
+            records = (pending + chunk).split(separator)
+            pending = records.pop()
+            yield from records
+        if pending:
+            yield pending
+
+        if proc.wait():
+            stderr.seek(0)
+            print(f"Error executing command: {shlex.join(argv)}", file=sys.stderr)
+            print(f"Error details: {decode(stderr.read())}", file=sys.stderr)
+            sys.exit(1)
+
+
+def print_json(results):
+    """Print results as indented JSON, one top-level list item at a time.
+
+    The output is the same as print(json.dumps(results, indent=2)), but the
+    whole document is never built up as a single string.
+    """
+    out = sys.stdout
+    out.write("{")
+    for i, (key, value) in enumerate(results.items()):
+        out.write(f"{',' if i else ''}\n  {json.dumps(key)}: ")
+        if isinstance(value, list) and value:
+            out.write("[")
+            for j, item in enumerate(value):
+                item = json.dumps(item, indent=2).replace("\n", "\n    ")
+                out.write(f"{',' if j else ''}\n    {item}")
+            out.write("\n  ]")
+        else:
+            out.write(json.dumps(value, indent=2).replace("\n", "\n  "))
+    out.write("\n}\n")
+
+
+def parse_ident(ident):
+    """Split a raw `Name <email> timestamp tz` ident into `%an <%ae>` and `%ci` strings."""
+    name, timestamp, tz = ident.rsplit(" ", 2)
+    offset = int(tz[1:3]) * 60 + int(tz[3:5])
+    if tz[0] == "-":
+        offset = -offset
+    date = datetime.fromtimestamp(int(timestamp), timezone(timedelta(minutes=offset)))
+    return name, f"{date:%Y-%m-%d %H:%M:%S} {tz}"
+
+
+def split_message(message):
+    """Split a commit message into its subject and body, like git's %s and %b.
+
+    The subject is the first paragraph with its lines joined by spaces.
+    """
+    lines = message.split("\n")
+    i = 0
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+
+    subject = []
+    while i < len(lines) and lines[i].strip():
+        subject.append(lines[i].rstrip())
+        i += 1
+
+    return " ".join(subject), "\n".join(lines[i:]).strip()
+
+
+class GitBatch:
+    """A long-lived `git cat-file --batch` process.
+
+    Object lookups are written to the process' stdin one at a time, which
+    avoids paying fork+exec+git startup for every query.
+    """
+
+    def __init__(self, path="."):
+        self.proc = subprocess.Popen(
+            ["git", "-C", path, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+    def request(self, rev):
+        """Look up an object and return its (hash, type, contents)."""
+        self.proc.stdin.write(f"{rev}\n".encode())
+        self.proc.stdin.flush()
+
+        header = self.proc.stdout.readline().decode()
+        fields = header.split()
+        if len(fields) != 3:
+            print(f"Error looking up object: {rev}", file=sys.stderr)
+            print(f"Error details: {header.strip()}", file=sys.stderr)
+            sys.exit(1)
+
+        object_hash, object_type, size = fields
+
+        # Contents are followed by a LF terminator
+        contents = self.proc.stdout.read(int(size) + 1)[:-1]
+        return object_hash, object_type, contents
+
+
+# One record per commit: \x1e starts a record, \x1f separates the fields.
+# With -z the message is NUL terminated and followed by the NUL separated
+# list of modified files.
+LOG_FORMAT = "%x1e%H%x1f%an <%ae>%x1f%ci%x1f%B"
+
+
+def literal_pathspec(path):
+    """Get a pathspec matching exactly path.
+
+    `literal` is the only pathspec magic that still lets git use the
+    commit-graph's changed-path Bloom filters; `top`, `glob` and wildcards
+    all disable them.
+    """
+    return f":(literal){path}"
+
+
+class Repo:
+    """A git repository.
+
+    Single commits are read through one `git cat-file --batch` process,
+    started on first use and reused until the repository is closed.
+    """
+
+    def __init__(self, path="."):
+        self.path = path
+        self.batch = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.batch:
+            self.batch.close()
+            self.batch = None
+
+    def git(self, *args, fatal=True):
+        """Run a git command in the repository and return its output."""
+        return run_command("git", "-C", self.path, *args, fatal=fatal)
+
+    def git_stream(self, *args, separator=b"\n"):
+        """Run a git command in the repository and yield its output one record at a time."""
+        return run_command_stream("git", "-C", self.path, *args, separator=separator)
+
+    def verify(self, *refs):
+        """Check that this is a git repository and that all refs exist.
+
+        Done in a single git invocation; either failing makes rev-parse
+        exit non-zero. The repository path is then switched to the top of
+        the working tree, so that pathspecs are relative to it even when
+        run from a subdirectory.
+
+        Returns the commit hash each ref resolves to.
+        """
+        output = self.git(
+            "rev-parse", "--show-toplevel", *(f"{ref}^{{commit}}" for ref in refs)
+        )
+        toplevel, *hashes = decode(output).split("\n")
+        self.path = toplevel
+        return hashes
+
+    def write_commit_graph(self):
+        """Write (or refresh) the repository's commit-graph file.
+
+        The commit-graph lets git walk history without inflating commit
+        objects, and its changed-path Bloom filters let `git log -- <path>`
+        skip commits that cannot have touched the path.
+
+        The graph is written as a split chain, so repeat runs only add a
+        small layer for new commits instead of rewriting the whole file.
+        It is only a cache: if it cannot be written (e.g. another git
+        process holds the lock) the analysis carries on without it.
+        """
+        self.git(
+            "commit-graph",
+            "write",
+            "--reachable",
+            "--changed-paths",
+            "--split",
+            fatal=False,
+        )
+
+    def commit(self, rev):
+        """Get the details of a single commit."""
+        if not self.batch:
+            self.batch = GitBatch(self.path)
+        commit_hash, _, contents = self.batch.request(rev)
+        header, _, message = contents.partition(b"\n\n")
+
+        headers = {}
+        for line in header.split(b"\n"):
+            # Continuation lines of multi-line headers (gpgsig, mergetag) are skipped
+            if line.startswith(b" "):
+                continue
+            key, _, value = line.partition(b" ")
+            headers.setdefault(key, []).append(decode(value))
+
+        author, _ = parse_ident(headers[b"author"][0])
+        _, date = parse_ident(headers[b"committer"][0])
+        return {
+            "hash": commit_hash,
+            "parents": headers.get(b"parent", []),
+            "author": author,
+            "date": date,
+            "message": decode(message.strip()),
+        }
+
+    def commits(self, rev_range, path=None, reverse=False):
+        """Yield the details of the non-merge commits in a range.
+
+        If path is given, only commits that modified it are included, but
+        their modified files still list everything they touched.
+        """
+        args = ["log", rev_range, "--no-merges", "-z", "--name-only"]
+        args.append(f"--format={LOG_FORMAT}")
+        if reverse:
+            args.append("--reverse")
+        if path:
+            args += ["--full-diff", "--", literal_pathspec(path)]
+
+        for record in self.git_stream(*args, separator=b"\x1e"):
+            if not record:
+                continue
+
+            commit_hash, author, date, rest = record.split(b"\x1f", 3)
+            message, _, files = rest.partition(b"\0")
+            files = files.removeprefix(b"\n").split(b"\0")
+
+            yield {
+                "hash": decode(commit_hash),
+                "author": decode(author),
+                "date": decode(date),
+                "message": decode(message.strip()),
+                "modified_files": [decode(f) for f in files if f],
+            }
+
+    def merges(self, rev_range):
+        """Yield the (hash, subject) of the merge commits in a range."""
+        for line in self.git_stream("log", "--merges", rev_range, "--format=%H %s"):
+            merge_hash, _, subject = line.partition(b" ")
+            yield decode(merge_hash), decode(subject)
+
+    def commit_graph(self, rev_range):
+        """Get the parents of every commit in a range.
+
+        Returns a dict mapping each commit hash to its (position, parents),
+        where position is the commit's index in topological order (children
+        first).
+        """
+        lines = self.git_stream("log", "--topo-order", rev_range, "--format=%H %P")
+
+        graph = {}
+        for position, line in enumerate(lines):
+            commit_hash, *parents = decode(line).split()
+            graph[commit_hash] = (position, parents)
+        return graph
+
+    def has_commits(self, rev_range, *options, path=None):
+        """Check if a range contains any commits, optionally filtered by log options or path."""
+        args = ["log", "--max-count=1", "--format=%H", *options, rev_range]
+        if path:
+            args += ["--", literal_pathspec(path)]
+        return bool(self.git(*args))
+
+    def commits_touching(self, rev_range, path):
+        """Get the set of non-merge commits in a range that modified path."""
+        lines = self.git_stream(
+            "log",
+            "--no-merges",
+            "--full-history",
+            "--no-renames",
+            rev_range,
+            "--format=%H",
+            "--",
+            literal_pathspec(path),
+        )
+        return {decode(line) for line in lines}
@@ -1,146 +1,199 @@
 #!/usr/bin/env python3
-import subprocess
-import json
 import os
 import sys
 import argparse
+import heapq
+from concurrent.futures import ProcessPoolExecutor
 
-
-def run_command(cmd):
-    """Run a shell command and return its output."""
-    try:
-        result = subprocess.run(
-            cmd,
-            shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-        )
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {cmd}", file=sys.stderr)
-        print(f"Error details: {e.stderr}", file=sys.stderr)
-        sys.exit(1)
+from gitutil import Repo, print_json, split_message
 
 
-def get_merge_commits(start_ref, end_ref):
-    """Get all merge commits between two git references."""
-    cmd = f"git log --merges {start_ref}^..{end_ref} --format='%H'"
-    merges = run_command(cmd)
-    return merges.split("\n") if merges else []
-
-
-def get_merge_details(merge_hash):
+def get_merge_details(repo, merge_hash):
     """Get details about a merge commit."""
-    # Get merge subject
-    subject = run_command(f"git show -s --format='%s' {merge_hash}")
-    
-    # Get merge message body
-    body = run_command(f"git show -s --format='%b' {merge_hash}")
-    
+    commit = repo.commit(merge_hash)
+    subject, body = split_message(commit["message"])
+
     # Get first and second parents
-    parent1 = run_command(f"git rev-parse {merge_hash}^1")
-    parent2 = run_command(f"git rev-parse {merge_hash}^2")
-    
-    # Get author name and email
-    author = run_command(f"git show -s --format='%an <%ae>' {merge_hash}")
-    
-    # Get commit date
-    date = run_command(f"git show -s --format='%ci' {merge_hash}")
-    
+    parent1, parent2 = commit["parents"][:2]
+
     return {
         "hash": merge_hash,
         "subject": subject,
         "body": body,
-        "author": author,
-        "date": date,
+        "author": commit["author"],
+        "date": commit["date"],
         "parent1": parent1,
         "parent2": parent2,
     }
 
 
-def get_commits_in_merge(parent1, parent2):
-    """Get all non-merge commits between two parent commits."""
-    cmd = f"git log --reverse --no-merges --format='%H' {parent1}..{parent2}"
-    commits = run_command(cmd)
-    return commits.split("\n") if commits else []
+def get_commits_in_merge(repo, parent1, parent2):
+    """Get the details of all non-merge commits between two parent commits."""
+    commits = []
+    for commit in repo.commits(f"{parent1}..{parent2}", reverse=True):
+        subject, message = split_message(commit["message"])
+        commits.append(
+            {
+                "hash": commit["hash"],
+                "subject": subject,
+                "message": message,
+                "author": commit["author"],
+                "date": commit["date"],
+                "modified_files": commit["modified_files"],
+            }
+        )
+    return commits
 
 
-def get_commit_details(commit_hash):
-    """Get the details of a specific commit."""
-    # Get commit subject
-    subject = run_command(f"git show -s --format='%s' {commit_hash}")
-    
-    # Get commit message
-    message = run_command(f"git show -s --format='%b' {commit_hash}")
-    
-    # Get modified files
-    files = run_command(f"git show --name-only --format='' {commit_hash}")
-    modified_files = [f for f in files.split("\n") if f]
-    
-    # Get author name and email
-    author = run_command(f"git show -s --format='%an <%ae>' {commit_hash}")
-    
-    # Get commit date
-    date = run_command(f"git show -s --format='%ci' {commit_hash}")
-    
-    return {
-        "hash": commit_hash,
-        "subject": subject,
-        "message": message,
-        "author": author,
-        "date": date,
-        "modified_files": modified_files,
-    }
+class IncompleteWalk(Exception):
+    """A merged-branch walk reached commits outside of the cached graph."""
+
 
+def get_descendants(graph, commit_hash):
+    """Get the commits in the graph that have commit_hash as an ancestor."""
+    descendants = set()
+    # Parents come after their children in the graph's topological order
+    for child, (_, parents) in reversed(graph.items()):
+        if any(p == commit_hash or p in descendants for p in parents):
+            descendants.add(child)
+    return descendants
 
-def check_merge_affects_verifier(parent1, parent2, target_file):
+
+def iter_merged_commits(graph, parent1, parent2, strict=False):
+    """Yield the commits reachable from parent2 but not from parent1 (parent1..parent2).
+
+    Walks the cached commit graph in topological order, painting commits
+    reachable from each parent, and stops as soon as only commits reachable
+    from parent1 are left to visit. Commits outside of the graph's range
+    are not walked. The walk is lazy, so callers can stop it early.
+
+    If strict, IncompleteWalk is raised when a commit reachable only from
+    parent2 has a parent outside of the graph, since the rest of the
+    branch may then be missing from the walk.
+    """
+    PARENT1, PARENT2 = 1, 2
+    flags = {}
+    queue = []
+    # Number of queued commits not (yet) known to be reachable from parent1
+    interesting = 0
+
+    def paint(commit_hash, flag):
+        nonlocal interesting
+        if commit_hash not in graph:
+            if strict and not flag & PARENT1:
+                raise IncompleteWalk(commit_hash)
+            return
+        old = flags.get(commit_hash, 0)
+        new = old | flag
+        if new == old:
+            return
+        flags[commit_hash] = new
+        if not old:
+            heapq.heappush(queue, (graph[commit_hash][0], commit_hash))
+            if not new & PARENT1:
+                interesting += 1
+        elif new & PARENT1 and not old & PARENT1:
+            interesting -= 1
+
+    paint(parent1, PARENT1)
+    paint(parent2, PARENT2)
+
+    while interesting:
+        _, commit_hash = heapq.heappop(queue)
+        flag = flags[commit_hash]
+        if not flag & PARENT1:
+            interesting -= 1
+            yield commit_hash
+        for parent in graph[commit_hash][1]:
+            paint(parent, flag)
+
+
+def check_merge_affects_verifier(merged_commits, touching_commits):
     """Check if merge affects the target file."""
-    cmd = f"git log --oneline {parent1}..{parent2} -- {target_file}"
-    result = run_command(cmd)
-    return bool(result)
+    return not touching_commits.isdisjoint(merged_commits)
 
 
-def check_merge_contains_merges(parent1, parent2):
-    """Check if this merge includes any other merges."""
-    cmd = f"git log --merges --oneline {parent1}..{parent2}"
-    result = run_command(cmd)
-    return bool(result)
+# Per-worker state, set up by init_worker
+worker_state = {}
 
 
-def main():
-    # Path to the file we're interested in
-    target_file = "kernel/bpf/verifier.c"
-    
-    # Set up argument parser
-    parser = argparse.ArgumentParser(
-        description=f"Find patchsets that modified {target_file} between two git references."
-    )
-    parser.add_argument(
-        "start_ref", help="Starting git reference (tag, branch, or commit hash)"
-    )
-    parser.add_argument(
-        "end_ref", help="Ending git reference (tag, branch, or commit hash)"
-    )
+def init_worker(path, target_file, graph, touching_commits, partial_merges):
+    """Set up a worker process for process_patchset."""
+    worker_state["target_file"] = target_file
+    worker_state["graph"] = graph
+    worker_state["touching_commits"] = touching_commits
+    worker_state["partial_merges"] = partial_merges
+    # The repository's cat-file process exits on its own once the worker
+    # closes its stdin by exiting.
+    worker_state["repo"] = Repo(path)
 
-    args = parser.parse_args()
 
-    # Check if we're in a git repository
-    if not os.path.exists(".git"):
-        print("Error: Not in a git repository", file=sys.stderr)
-        sys.exit(1)
+def process_patchset(merge_hash):
+    """Build the patchset entry for a merge commit, or None if the merge is not of interest."""
+    graph = worker_state["graph"]
+    repo = worker_state["repo"]
+
+    parent1, parent2 = graph[merge_hash][1][:2]
 
-    # Verify that the refs exist
     try:
-        run_command(f"git rev-parse {args.start_ref}")
-        run_command(f"git rev-parse {args.end_ref}")
-    except subprocess.CalledProcessError:
-        print(f"Error: One or both git references do not exist", file=sys.stderr)
-        sys.exit(1)
+        # Skip if this merge contains other merges. The walk stops at the
+        # first one, so large merges of merges are rejected without listing
+        # them.
+        merged_commits = []
+        strict = merge_hash in worker_state["partial_merges"]
+        for commit_hash in iter_merged_commits(graph, parent1, parent2, strict):
+            if len(graph[commit_hash][1]) > 1:
+                return None
+            merged_commits.append(commit_hash)
+
+        affects_verifier = check_merge_affects_verifier(
+            merged_commits, worker_state["touching_commits"]
+        )
+    except IncompleteWalk:
+        # The branch reaches back past the start of the cached graph, so ask
+        # git about all of it instead
+        merge_range = f"{parent1}..{parent2}"
+        if repo.has_commits(merge_range, "--merges"):
+            return None
+        affects_verifier = repo.has_commits(
+            merge_range, path=worker_state["target_file"]
+        )
+
+    # Check if this merge affects verifier code
+    if not affects_verifier:
+        return None
+
+    # Only look up the full details of merges that are of interest
+    merge_details = get_merge_details(repo, merge_hash)
 
     print(
-        f"Analyzing merge commits between {args.start_ref} and {args.end_ref} that affect {target_file}",
+        f"Found ({merge_hash})  {merge_details['subject']}",
+        file=sys.stderr,
+    )
+
+    # Get all commits in this merge
+    commits = get_commits_in_merge(repo, parent1, parent2)
+
+    # Create patchset entry
+    return {
+        "merge_hash": merge_hash,
+        "merge_subject": merge_details["subject"],
+        "merge_body": merge_details["body"],
+        "merge_author": merge_details["author"],
+        "merge_date": merge_details["date"],
+        "commits": commits,
+    }
+
+
+def analyze_patchsets(repo, start_ref, end_ref, target_file, start_parent):
+    """Get the patchsets that modified the target file between two git references.
+
+    start_parent is the hash of start_ref's first parent.
+    """
+    rev_range = f"{start_ref}^..{end_ref}"
+
+    print(
+        f"Analyzing merge commits between {start_ref} and {end_ref} that affect {target_file}",
         file=sys.stderr,
     )
 
@@ -148,64 +201,85 @@ def main():
     results = {
         "metadata": {
             "target_file": target_file,
-            "start_ref": args.start_ref,
-            "end_ref": args.end_ref,
+            "start_ref": start_ref,
+            "end_ref": end_ref,
         },
         "patchsets": [],
     }
 
-    # Get all merge commits between the refs
-    merge_commits = get_merge_commits(args.start_ref, args.end_ref)
-
-    # Process each merge commit
-    for merge_hash in merge_commits:
-        if not merge_hash:  # Skip empty lines
-            continue
-            
-        merge_details = get_merge_details(merge_hash)
-        parent1 = merge_details["parent1"]
-        parent2 = merge_details["parent2"]
-        
-        # Skip if this merge contains other merges
-        if check_merge_contains_merges(parent1, parent2):
-            continue
-            
-        # Skip if this is a tag merge
-        if "Merge tag" in merge_details["subject"]:
-            continue
-            
-        # Check if this merge affects verifier code
-        if check_merge_affects_verifier(parent1, parent2, target_file):
-            print(
-                f"Found ({merge_hash})  {merge_details['subject']}",
-                file=sys.stderr,
-            )
-
-            # Get all commits in this merge
-            commit_hashes = get_commits_in_merge(parent1, parent2)
-            commits = []
-            
-            for commit_hash in commit_hashes:
-                if commit_hash:  # Skip empty lines
-                    commit_details = get_commit_details(commit_hash)
-                    commits.append(commit_details)
-            
-            # Create patchset entry
-            patchset = {
-                "merge_hash": merge_hash,
-                "merge_subject": merge_details["subject"],
-                "merge_body": merge_details["body"],
-                "merge_author": merge_details["author"],
-                "merge_date": merge_details["date"],
-                "commits": commits,
-            }
-            
-            results["patchsets"].append(patchset)
+    # Get all merge commits between the refs, skipping tag merges up front
+    # based on their subject alone
+    merge_commits = (
+        merge_hash
+        for merge_hash, subject in repo.merges(rev_range)
+        if "Merge tag" not in subject
+    )
+
+    # Pre-compute the commit graph and the commits touching the target file
+    # once instead of walking each merge's branch with git log
+    graph = repo.commit_graph(rev_range)
+    touching_commits = repo.commits_touching(rev_range, target_file)
+
+    # Every commit outside of the graph is an ancestor of start_ref^. A
+    # merge's branch is therefore only fully covered by the graph if its
+    # first parent contains start_ref^; for the others, walks that leave
+    # the graph fall back to asking git.
+    start_descendants = get_descendants(graph, start_parent)
+    partial_merges = {
+        commit_hash
+        for commit_hash, (_, parents) in graph.items()
+        if len(parents) > 1
+        and parents[0] != start_parent
+        and parents[0] not in start_descendants
+    }
+
+    # Merges are independent of each other, so process them in parallel.
+    # Each worker gets its own copy of the cached graph and its own
+    # cat-file process.
+    with ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        initializer=init_worker,
+        initargs=(repo.path, target_file, graph, touching_commits, partial_merges),
+    ) as executor:
+        patchsets = executor.map(process_patchset, merge_commits)
+        results["patchsets"] = [p for p in patchsets if p]
 
     results["metadata"]["patchset_count"] = len(results["patchsets"])
+    return results
+
+
+def main():
+    # Path to the file we're interested in
+    target_file = "kernel/bpf/verifier.c"
+    
+    # Set up argument parser
+    parser = argparse.ArgumentParser(
+        description=f"Find patchsets that modified {target_file} between two git references."
+    )
+    parser.add_argument(
+        "start_ref", help="Starting git reference (tag, branch, or commit hash)"
+    )
+    parser.add_argument(
+        "end_ref", help="Ending git reference (tag, branch, or commit hash)"
+    )
+
+    args = parser.parse_args()
+
+    with Repo() as repo:
+        # Check that we're in a git repository and that both refs exist,
+        # resolving start_ref's parent along the way
+        _, _, start_parent = repo.verify(
+            args.start_ref, args.end_ref, f"{args.start_ref}^"
+        )
+        # Make sure the history walks below can use a commit-graph
+        repo.write_commit_graph()
+
+        results = analyze_patchsets(
+            repo, args.start_ref, args.end_ref, target_file, start_parent
+        )
 
     # Output the results as JSON to stdout
-    print(json.dumps(results, indent=2))
+    print_json(results)
 
 
 if __name__ == "__main__":